@@ -2,27 +2,38 @@
 
 """See top level package docstring for documentation"""
 
+import bisect
 import datetime
-import importlib
+import functools
+import hashlib
+import importlib.util
+import itertools
 import logging
 import os
 import pathlib
 import re
 import sys
 import typing
+from dataclasses import dataclass, field
 
-import attr
-import mako.template
-import mako.lookup
-import mako.exceptions
-
-import optini
+# mako and optini are imported where used to keep startup fast
 
 myself = pathlib.Path(__file__).stem
 
 logger = logging.getLogger(myself)
 logging.getLogger(myself).addHandler(logging.NullHandler())
 
+# large write buffer, fewer write syscalls for big outputs
+_WRITE_BUFFER = 1 << 20
+
+# bare module name, 'import x [as y]', or 'from x[.y] import z [as w]'
+# only the top level package is captured for the find_spec check
+_IMPORT_ALL_RE = re.compile(
+    r'^(?:(?P<bare>\w+)$'
+    r'|import\s+(?P<imp>\w+)'
+    r'|from\s+(?P<frm>\w+)(?:\.\w+)*\s+import\s+\w+)'
+)
+
 ########################################################################
 
 
@@ -30,10 +41,58 @@ def datestamp(format='%Y-%m-%d_%H-%M-%S'):
     return(datetime.datetime.now().strftime(format))
 
 
+@functools.lru_cache(maxsize=None)
+def _module_exists(name):
+    'find_spec searches sys.path on disk, so remember the answer'
+    return importlib.util.find_spec(name) is not None
+
+
+def _compile(tmpl, cache_dir=None):
+    'compile template text, through the disk cache when one is set'
+    import mako.lookup
+    import mako.template
+    # to support loading sub-templates
+    lookup_dirs = []
+    # always look in the current directory
+    lookup_dirs.append(".")
+    if cache_dir is not None:
+        try:
+            return _compile_cached(tmpl, cache_dir, lookup_dirs)
+        except OSError as e:
+            logger.debug("template cache unusable, compiling in memory: %s", e)
+    lookup = mako.lookup.TemplateLookup(directories=lookup_dirs)
+    return mako.template.Template(text=tmpl, lookup=lookup)
+
+
+def _compile_cached(tmpl, cache_dir, lookup_dirs):
+    'compile template text through the on-disk module cache'
+    import mako.lookup
+    import mako.template
+    os.makedirs(cache_dir, exist_ok=True)
+    lookup = mako.lookup.TemplateLookup(
+        directories=lookup_dirs,
+        module_directory=cache_dir,
+    )
+    # mako only caches modules for templates loaded from files
+    # so store the text under a name derived from its digest
+    name = hashlib.sha1(tmpl.encode('utf-8')).hexdigest() + '.mako'
+    source = os.path.join(cache_dir, name)
+    if not os.path.isfile(source):
+        partial = f"{source}.{os.getpid()}"
+        pathlib.Path(partial).write_bytes(tmpl.encode('utf-8'))
+        os.replace(partial, source)
+    return mako.template.Template(
+        filename=source,
+        uri=name,
+        lookup=lookup,
+        module_directory=cache_dir,
+    )
+
+
 ########################################################################
 
 
-@attr.s(auto_attribs=True)
+@dataclass(slots=True)
 class Isurus:
     '''
     Class that simplifies rendering arbitrary mako templates
@@ -56,7 +115,7 @@ class Isurus:
     Attributes
     ----------
 
-    input : str
+    input : str or path-like
         template input as either file name or string
     markdown : bool (default: False)
         disable '##' mako comments by wrapping with Mako <%text> tags
@@ -64,160 +123,229 @@ class Isurus:
         set markdown=False to pass '##' through verbatim
     save : bool (default: False)
         saving a copy of pre-rendered template in current dir
+    savefile : str (default: None)
+        file name for the saved template when save is True
+        defaults to isurus_<datestamp>.mako, stamped at save time
+
+    If $ISURUS_CACHE names a directory, compiled templates are cached
+    there and reused across runs. Each distinct template adds two files
+    and nothing is removed automatically; delete the directory to clear
+    the cache. Without $ISURUS_CACHE nothing is written to disk.
     '''
     input: str
     markdown: bool = False
     save: bool = False
-    _pre: typing.List[int] = attr.Factory(list)
-    _post: typing.List[int] = attr.Factory(list)
-    _imports: typing.Set[str] = attr.Factory(set)
-
-    def __attrs_post_init__(self):
-        if os.path.exists(self.input):
-            self.input = open(self.input, 'r').read()
+    savefile: typing.Optional[str] = None
+    # filled through add_pre, add_post, and add_import only
+    _pre: typing.List[int] = field(default_factory=list, init=False)
+    _post: typing.List[int] = field(default_factory=list, init=False)
+    # kept sorted on insert, with a set for duplicate checks
+    _imports: typing.List[str] = field(default_factory=list, init=False)
+    _imports_set: typing.Set[str] = field(
+        default_factory=set, init=False, repr=False)
+    # compiled template cache, invalidated by add_* and input changes
+    _dirty: bool = field(
+        default=True, init=False, repr=False, compare=False)
+    _cached_key: typing.Optional[tuple] = field(
+        default=None, init=False, repr=False, compare=False)
+    _cached_tmpl_text: typing.Optional[str] = field(
+        default=None, init=False, repr=False, compare=False)
+    _cached_compiled: typing.Any = field(
+        default=None, init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        # path objects are always files
+        # long strings cannot be file names, skip the stat for them
+        if isinstance(self.input, os.PathLike) or (
+            len(self.input) < 4096 and os.path.isfile(self.input)
+        ):
+            self.input = pathlib.Path(self.input).read_text(encoding='utf-8')
         # else assume input is the mako template as a string
 
     def template(self):
         'construct full template as string'
-        pre = self.pre()
-        post = self.post()
+
+        def pre():
+            'template header'
+            yield r'<%!'
+            yield from self._imports
+            yield from self._pre
+            # mako line continuation: body starts on its own line
+            # without emitting a newline ahead of it
+            yield '%>\\'
+
+        def post():
+            'template footer'
+            # no need for enclosing tags if post is empty
+            if not self._post:
+                return
+            yield r'<%'
+            yield from self._post
+            yield r'%>'
+
         # break input into list of lines for consistency with pre and post
-        lines = map(
-            lambda x: x.rstrip("\n"),
-            self.input.split("\n"),
-        )
-        lines = list(lines)
-        if len(lines) > 0 and re.search(r'^#!', lines[0]):
-            logger.debug(f"stripping out #! line: {lines[0]}")
-            lines = lines[1:]
+        raw = self.input.split("\n")
+        start = 1 if raw and raw[0].startswith('#!') else 0
+        if start:
+            logger.debug("stripping out #! line: %s", raw[0])
+        # lazy iterators, consumed once by the join below
+        lines = itertools.islice(raw, start, None)
         if self.markdown:
             # disable mako '##' comments
             # ^## conflicts with markdown header syntax
-            lines = map(
-                lambda x: re.sub(r'^##', '<%text>##</%text>', x),
-                lines,
+            lines = (
+                '<%text>##</%text>' + x[2:] if x.startswith('##') else x
+                for x in lines
             )
-        lines = list(lines)
-        # use plus to avoid newlines between pre, body, and post
-        return "\n".join(pre) + "\n".join(lines) + "\n".join(post)
         # join everything back together as a single string
+        # use plus to avoid a newline between body and post
+        return (
+            "\n".join(itertools.chain(pre(), lines))
+            + "\n".join(post())
+        )
 
-    def render(self):
-        # to support loading sub-templates
-        lookup_dirs = []
-        # always look in the current directory
-        lookup_dirs.append(".")
-        lookup = mako.lookup.TemplateLookup(directories=lookup_dirs)
-        # mako can only load templates from string or filename
-        # so truly lazy template read is difficult
-        # could construct another temporary file on disk
-        # reading the template into memory seems like best compromise
-        tmpl = self.template()
+    def compiled(self):
+        'return compiled mako template, reused until inputs change'
+        key = (self.input, self.markdown)
+        if self._dirty or key != self._cached_key:
+            # mako can only load templates from string or filename
+            # so truly lazy template read is difficult
+            # could construct another temporary file on disk
+            # reading the template into memory seems like best compromise
+            self._cached_tmpl_text = self.template()
+            self._cached_compiled = None
+            self._cached_key = key
+            self._dirty = False
+        tmpl = self._cached_tmpl_text
+        # save on every render, even when the compiled template is reused
         if self.save:
             logger.info('saving complete intermediate template...')
-            savefile = f"isurus_{datestamp()}.mako"
-            open(savefile, 'w').write(tmpl)
-            logger.info(f"saved intermediate template: {savefile}")
+            savefile = self.savefile or f"isurus_{datestamp()}.mako"
+            with open(savefile, 'w', buffering=_WRITE_BUFFER) as f:
+                f.write(tmpl)
+            logger.info("saved intermediate template: %s", savefile)
+        if self._cached_compiled is None:
+            # opt-in on-disk cache of compiled mako modules
+            cache_dir = os.environ.get('ISURUS_CACHE') or None
+            self._cached_compiled = _compile(tmpl, cache_dir)
+        return self._cached_compiled
+
+    def render(self, context=None):
+        'render template, into a mako Context if given, else as string'
         try:
-            return(mako.template.Template(text=tmpl, lookup=lookup).render())
+            if context is None:
+                return(self.compiled().render())
+            self.compiled().render_context(context)
         except Exception as e:
+            import mako.exceptions
             logger.error("mako failed to render template")
-            logger.error(f"{e}")
+            logger.error("%s", e)
             traceback = mako.exceptions.RichTraceback()
             for (filename, lineno, function, line) in traceback.traceback:
-                logger.debug(f"file {filename}, line {lineno}, in {function}")
-                logger.debug(f"line: {line}")
+                logger.debug(
+                    "file %s, line %s, in %s", filename, lineno, function)
+                logger.debug("line: %s", line)
             sys.exit(1)
 
     def renderfile(self, filename):
         'write rendered template to file'
-        with open(filename, "wt") as f:
-            f.write(self.render())
-        logger.info(f"wrote {filename}")
+        import mako.runtime
+        # stream output into the file rather than building a string
+        with open(filename, "wt", buffering=_WRITE_BUFFER) as f:
+            self.render(mako.runtime.Context(f))
+        logger.info("wrote %s", filename)
 
     def verify_import(self, import_statement):
         'examine import statement, flag potential problems'
         module = None
-        # element = None
 
         import_statement = import_statement.strip()
 
-        # treat single tokens as module names, prepend 'import '
-        pattern = r'^(\w+)$'
-        match = re.search(pattern, import_statement)
-        if match:
-            module = match.group(1)
-            import_statement = f"import {module}"
-        # this should also catch 'import x as y'
-        pattern = r'^import\s+(\w+)'
-        match = re.search(pattern, import_statement)
+        match = _IMPORT_ALL_RE.match(import_statement)
         if match:
-            module = match.group(1)
-        # this should also catch 'from x import y as z'
-        pattern = r'^from\s+(\w+)\s+import\s+(\w+)'
-        match = re.search(pattern, import_statement)
-        if match:
-            module = match.group(1)
-            # element = match.group(2)
+            module = match['bare'] or match['imp'] or match['frm']
+            # treat single tokens as module names, prepend 'import '
+            if match['bare']:
+                import_statement = f"import {module}"
         # checking if element exists without importing is a hassle
         # ignore such additional check for now
 
         if module is None:
-            logger.error(f"unable to parse: {import_statement}")
+            logger.error("unable to parse: %s", import_statement)
         else:
-            if importlib.util.find_spec(module) is None:
-                logger.error(f"unable to find module {module}")
+            if not _module_exists(module):
+                logger.error("unable to find module %s", module)
                 sys.exit(1)
         return(import_statement)
 
     def add_import(self, import_statement):
         'import module into template namespace'
         import_statement = self.verify_import(import_statement)
-        self._imports.add(import_statement)
-
-    def pre(self):
-        'return template header'
-        preamble = []
-        preamble.append(r'<%!')
-        preamble.extend(sorted(self._imports))
-        preamble.extend(self._pre)
-        preamble.append(r'%>')
-        return(preamble)
-
-    def post(self):
-        'return template footer'
-        post = []
-        # no need for enclusing tags if post is empty
-        if len(self._post) == 0:
-            return([])
-        post.append(r'<%')
-        post.extend(self._post)
-        post.append(r'%>')
-        return(post)
+        if import_statement not in self._imports_set:
+            bisect.insort(self._imports, import_statement)
+            self._imports_set.add(import_statement)
+            self._dirty = True
 
     def add_pre(self, pythoncode):
         'add arbitrary python code to template header'
         self._pre.append(pythoncode)
+        self._dirty = True
 
     def add_post(self, pythoncode):
         'add arbitrary python code to template footer'
         self._post.append(pythoncode)
+        self._dirty = True
 
     def __str__(self):
         return self.render()
 
+    @classmethod
+    def render_batch(cls, bodies, imports=(), pre=(), post=(), **kwargs):
+        '''
+        render many template bodies with shared imports, pre, and post
+
+        bodies are file names or template strings, like input
+        imports are verified once, and repeated bodies are only
+        compiled once; other keyword arguments go to the constructor
+        returns a list of rendered strings in the order of bodies
+        '''
+        shared = cls('', **kwargs)
+        for import_statement in imports:
+            shared.add_import(import_statement)
+        for pythoncode in pre:
+            shared.add_pre(pythoncode)
+        for pythoncode in post:
+            shared.add_post(pythoncode)
+        # one instance per distinct body, dropped when the batch ends
+        templates = {}
+        rendered = []
+        for body in bodies:
+            template = cls(body, **kwargs)
+            if template.input in templates:
+                # reuse the instance, and its compiled template
+                template = templates[template.input]
+            else:
+                # share the verified header and footer, never mutated here
+                template._pre = shared._pre
+                template._post = shared._post
+                template._imports = shared._imports
+                template._imports_set = shared._imports_set
+                templates[template.input] = template
+            rendered.append(template.render())
+        return rendered
+
 
 def derive_output(input):
-    match = re.search(r'(.*)\.mako$', input, re.IGNORECASE)
-    if match:
-        output = match.group(1)
+    if input.lower().endswith('.mako'):
+        output = input[:-len('.mako')]
     else:
         output = f"isurus_out_{datestamp()}.txt"
-    logger.debug(f"output = {output}")
+    logger.debug("output = %s", output)
     return output
 
 
 def main():
+    import optini
     desc = 'Humane Mako template preprocessor interface/filter'
     # 'default': sys.argv[-1],
     optini.spec.input.help = 'input file'
@@ -228,7 +356,7 @@ def main():
     optini.spec.Markdown.help = 'assume markdown input (no "##" comments)'
     optini.Config(appname='isurus', desc=desc, logging=True)
 
-    logger.debug(f"input = {optini.opt.input}")
+    logger.debug("input = %s", optini.opt.input)
     template = Isurus(optini.opt.input, markdown=optini.opt.Markdown)
     if optini.opt.input is None:
         if len(optini.opt._unparsed[0]) > 0:
@@ -239,7 +367,7 @@ def main():
     if optini.opt.output is None:
         optini.opt.output = derive_output(optini.opt.input)
     if os.path.exists(optini.opt.output) and not optini.opt.Replace:
-        logger.error(f"output file exists: {optini.opt.output}")
+        logger.error("output file exists: %s", optini.opt.output)
         logger.error('replace option (-R/--Replace) not specified')
         sys.exit(1)
     template.renderfile(optini.opt.output)
@@ -3,9 +3,17 @@
 """Tests for `isurus` package."""
 
 
+import importlib.util
+import os
+import pathlib
+import tempfile
 import unittest
+import unittest.mock as mock
 
-# from isurus import isurus
+import mako.template
+
+import isurus.isurus
+from isurus import Isurus
 
 
 class TestIsurus(unittest.TestCase):
@@ -13,9 +21,129 @@ class TestIsurus(unittest.TestCase):
 
     def setUp(self):
         """Set up test fixtures, if any."""
+        self.tmpdir = tempfile.TemporaryDirectory()
 
     def tearDown(self):
         """Tear down test fixtures, if any."""
+        self.tmpdir.cleanup()
+
+    def test_000_render(self):
+        """Render a template with an import and header code."""
+        template = Isurus('${x} ${math.floor(2.5)}\n')
+        template.add_import('math')
+        template.add_pre('x = 1')
+        self.assertEqual(template.render(), '1 2\n')
+
+    def test_001_rerender_after_add_pre(self):
+        """Cached template is rebuilt after add_pre."""
+        template = Isurus('${x}')
+        template.add_pre('x = 1')
+        self.assertEqual(template.render(), '1')
+        template.add_pre('x = 2')
+        self.assertEqual(template.render(), '2')
+
+    def test_002_rerender_after_input_change(self):
+        """Cached template is rebuilt after input changes."""
+        template = Isurus('a')
+        self.assertEqual(template.render(), 'a')
+        template.input = 'b'
+        self.assertEqual(template.render(), 'b')
+
+    def test_003_imports_sorted_and_deduped(self):
+        """Imports stay sorted and duplicates keep the cached template."""
+        template = Isurus('x')
+        for statement in ('sys', 'os', 'import os'):
+            template.add_import(statement)
+        self.assertTrue(
+            template.template().startswith('<%!\nimport os\nimport sys\n'))
+        compiled = template.compiled()
+        template.add_import('os')
+        self.assertIs(template.compiled(), compiled)
+
+    def test_004_verify_bare_import(self):
+        """Bare module names become import statements."""
+        self.assertEqual(Isurus('').verify_import(' os '), 'import os')
+
+    def test_005_module_lookup_cached(self):
+        """Repeated imports of a module look it up only once."""
+        isurus.isurus._module_exists.cache_clear()
+        find_spec = importlib.util.find_spec
+        with mock.patch('importlib.util.find_spec', wraps=find_spec) as spy:
+            Isurus('').add_import('os')
+            Isurus('').add_import('from os import path')
+        spy.assert_called_once_with('os')
+
+    def test_006_renderfile_matches_render(self):
+        """Streamed file output equals the rendered string."""
+        template = Isurus('## x\n% for i in range(3):\n${i}\n% endfor\n',
+                          markdown=True)
+        filename = os.path.join(self.tmpdir.name, 'out.txt')
+        template.renderfile(filename)
+        with open(filename) as f:
+            self.assertEqual(f.read(), template.render())
+
+    def test_007_verify_dotted_from_import(self):
+        """Dotted from-imports resolve their top level package."""
+        template = Isurus('')
+        statement = 'from os.path import join'
+        self.assertEqual(template.verify_import(statement), statement)
+        template.add_import(statement)
+        template.input = '${join("a", "b")}'
+        self.assertEqual(template.render(), os.path.join('a', 'b'))
+
+    def test_008_post_adds_no_newline(self):
+        """Footer code does not change the rendered body."""
+        for body in ('hello\nworld', 'body\n'):
+            template = Isurus(body)
+            template.add_post('y = 2')
+            self.assertEqual(template.render(), body)
+
+    def test_009_crlf_file(self):
+        """Template files get universal newline translation."""
+        filename = os.path.join(self.tmpdir.name, 'crlf.mako')
+        with open(filename, 'wb') as f:
+            f.write(b'a\r\nb ${1}\r\n')
+        self.assertEqual(Isurus(filename).render(), 'a\nb 1\n')
+
+    def test_010_savefile(self):
+        """Intermediate template is saved to savefile on each render."""
+        savefile = os.path.join(self.tmpdir.name, 'saved.mako')
+        template = Isurus('${1 + 1}')
+        template.render()
+        self.assertFalse(os.path.exists(savefile))
+        template.save = True
+        template.savefile = savefile
+        self.assertEqual(template.render(), '2')
+        with open(savefile) as f:
+            self.assertEqual(f.read(), template.template())
+
+    def test_011_render_batch(self):
+        """Batch output equals single renders, repeats compile once."""
+        bodies = ['a ${x}\n', '## b ${math.floor(1.5)}\n', 'a ${x}\n']
+        imports = ['math']
+        pre = ['x = 1']
+        post = ['q = 1']
+        expected = []
+        for body in bodies:
+            template = Isurus(body, markdown=True)
+            for statement in imports:
+                template.add_import(statement)
+            for code in pre:
+                template.add_pre(code)
+            for code in post:
+                template.add_post(code)
+            expected.append(template.render())
+        compile_ = mako.template.Template
+        with mock.patch('mako.template.Template', wraps=compile_) as spy:
+            rendered = Isurus.render_batch(
+                bodies, imports=imports, pre=pre, post=post, markdown=True)
+        self.assertEqual(rendered, expected)
+        self.assertEqual(spy.call_count, 2)
+        self.assertEqual(
+            Isurus.render_batch(['b\n'], post=['q = 1']), ['b\n'])
 
-    def test_000_something(self):
-        """Test something."""
+    def test_012_path_input(self):
+        """Path objects are read as template files."""
+        filename = pathlib.Path(self.tmpdir.name) / 't.mako'
+        filename.write_text('hi ${1}')
+        self.assertEqual(Isurus(filename).render(), 'hi 1')